@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Offline audit verifier for the votes and audit_logs tables.
+
+Streams both tables (from Supabase, or from local CSV/JSONL dumps) in
+keyset-paginated chunks, spills the rows into on-disk shards keyed by
+vote_hash, then reconciles the shards in a process pool. Each worker holds
+one shard in memory at a time, so peak memory is roughly workers × shard
+size; raise --shards or lower --workers to reduce it.
+
+Checks performed:
+  • every vote_hash is unique in votes and in audit_logs (vote_cast rows)
+  • every vote has a matching audit log entry and vice versa
+  • a matched vote and audit entry agree on election, candidate and user
+  • per-candidate recounts from votes and from audit_logs agree
+  • optionally, the recount matches what /api/elections/<id>/results reports
+
+Usage:
+  python audit_verify.py
+  python audit_verify.py --votes votes.csv --audit-logs audit_logs.csv
+  python audit_verify.py --election-id <uuid> --api-url http://localhost:5000
+
+Exits with status 1 if any discrepancy is found or no rows were scanned.
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.client import HTTPException
+from urllib.request import urlopen
+
+VOTE_COLUMNS = ['id', 'vote_hash', 'election_id', 'candidate_id', 'user_id']
+AUDIT_COLUMNS = ['id', 'vote_hash', 'election_id', 'candidate_id', 'user_id', 'action']
+SHARD_FIELDS = ['vote_hash', 'election_id', 'candidate_id', 'user_id']
+COMPARED_FIELDS = ['election_id', 'candidate_id', 'user_id']
+# partition() keeps every shard file open at once; stay well under the usual ulimit -n
+MAX_SHARDS = 512
+
+
+def iter_table_chunks(client, table, columns, chunk_size, election_id=None, action=None):
+    """Yield rows of a Supabase table in chunks, paginating on the primary key"""
+    last_id = None
+    while True:
+        query = client.table(table).select(','.join(columns))
+        if election_id:
+            query = query.eq('election_id', election_id)
+        if action:
+            query = query.eq('action', action)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.order('id').limit(chunk_size).execute().data
+        if not rows:
+            return
+        # Short pages are not the end: PostgREST silently caps responses at max_rows
+        yield rows
+        last_id = rows[-1]['id']
+
+
+def iter_dump_chunks(path, chunk_size, election_id=None, action=None):
+    """Yield rows of a CSV or JSONL table dump in chunks"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl') or path.endswith('.ndjson'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+
+        chunk = []
+        for row in rows:
+            if election_id and row.get('election_id') != election_id:
+                continue
+            # Dumps without an action column are treated as vote_cast entries
+            if action and row.get('action', action) != action:
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def shard_for(vote_hash, num_shards):
+    """Pick the shard a vote_hash belongs to"""
+    return zlib.crc32(vote_hash.encode()) % num_shards
+
+
+def partition(chunks, shard_dir, prefix, num_shards):
+    """Spill streamed rows into per-shard CSV files, returning the row count"""
+    files = [
+        open(os.path.join(shard_dir, f'{prefix}_{i}.csv'), 'w', newline='', encoding='utf-8')
+        for i in range(num_shards)
+    ]
+    writers = [csv.writer(f) for f in files]
+    total = 0
+    try:
+        for chunk in chunks:
+            for row in chunk:
+                vote_hash = row.get('vote_hash') or ''
+                writers[shard_for(vote_hash, num_shards)].writerow(
+                    [str(row.get(field) or '') for field in SHARD_FIELDS]
+                )
+            total += len(chunk)
+    finally:
+        for f in files:
+            f.close()
+    return total
+
+
+def _read_shard(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for values in csv.reader(f):
+            yield dict(zip(SHARD_FIELDS, values))
+
+
+def verify_shard(args):
+    """Reconcile one shard of votes against the same shard of audit_logs"""
+    shard_dir, index, max_examples = args
+    result = {
+        'vote_counts': Counter(),
+        'audit_counts': Counter(),
+        'totals': Counter(),
+        'examples': {},
+    }
+
+    def report(kind, detail):
+        result['totals'][kind] += 1
+        examples = result['examples'].setdefault(kind, [])
+        if len(examples) < max_examples:
+            examples.append(detail)
+
+    votes = {}
+    for row in _read_shard(os.path.join(shard_dir, f'votes_{index}.csv')):
+        vote_hash = row['vote_hash']
+        result['vote_counts'][(row['election_id'], row['candidate_id'])] += 1
+        if not vote_hash:
+            report('vote_missing_hash', row)
+        elif vote_hash in votes:
+            report('duplicate_vote_hash', vote_hash)
+        else:
+            votes[vote_hash] = tuple(row[field] for field in COMPARED_FIELDS)
+
+    seen_audit = set()
+    for row in _read_shard(os.path.join(shard_dir, f'audit_{index}.csv')):
+        vote_hash = row['vote_hash']
+        result['audit_counts'][(row['election_id'], row['candidate_id'])] += 1
+        if not vote_hash:
+            report('audit_missing_hash', row)
+            continue
+        if vote_hash in seen_audit:
+            report('duplicate_audit_hash', vote_hash)
+            continue
+        seen_audit.add(vote_hash)
+
+        vote = votes.get(vote_hash)
+        if vote is None:
+            report('audit_without_vote', vote_hash)
+            continue
+        for field, vote_value in zip(COMPARED_FIELDS, vote):
+            if vote_value != row[field]:
+                report('field_mismatch', {
+                    'vote_hash': vote_hash,
+                    'field': field,
+                    'vote': vote_value,
+                    'audit': row[field],
+                })
+
+    for vote_hash in votes.keys() - seen_audit:
+        report('vote_without_audit', vote_hash)
+
+    return result
+
+
+def fetch_api_results(api_url, election_id, timeout):
+    """Fetch per-candidate vote counts from the results endpoint"""
+    url = f"{api_url.rstrip('/')}/api/elections/{election_id}/results"
+    with urlopen(url, timeout=timeout) as response:
+        data = json.load(response)
+    if not isinstance(data, dict):
+        raise ValueError(f'Unexpected response: {data!r}')
+    return {r['candidate_id']: r['vote_count'] for r in data.get('results', [])}
+
+
+def run(args):
+    """Stream, shard and reconcile both tables, returning the merged report"""
+    shard_dir = tempfile.mkdtemp(prefix='audit_verify_', dir=args.work_dir)
+    try:
+        if args.votes and args.audit_logs:
+            vote_chunks = iter_dump_chunks(args.votes, args.chunk_size, args.election_id)
+            audit_chunks = iter_dump_chunks(args.audit_logs, args.chunk_size,
+                                            args.election_id, action='vote_cast')
+        else:
+            from dotenv import load_dotenv
+            from supabase import create_client
+
+            load_dotenv()
+            # Service role key is needed to read every row past RLS; the anon
+            # key would silently return nothing and pass the audit
+            service_key = os.getenv('SUPABASE_SERVICE_KEY')
+            if not service_key:
+                sys.exit('Error: SUPABASE_SERVICE_KEY must be set to read votes and audit_logs')
+            client = create_client(os.getenv('SUPABASE_URL', 'your-supabase-url'), service_key)
+            vote_chunks = iter_table_chunks(client, 'votes', VOTE_COLUMNS,
+                                            args.chunk_size, args.election_id)
+            audit_chunks = iter_table_chunks(client, 'audit_logs', AUDIT_COLUMNS,
+                                             args.chunk_size, args.election_id,
+                                             action='vote_cast')
+
+        total_votes = partition(vote_chunks, shard_dir, 'votes', args.shards)
+        total_audit = partition(audit_chunks, shard_dir, 'audit', args.shards)
+
+        report = {
+            'total_votes': total_votes,
+            'total_audit_logs': total_audit,
+            'vote_counts': Counter(),
+            'audit_counts': Counter(),
+            'totals': Counter(),
+            'examples': {},
+        }
+        tasks = [(shard_dir, i, args.max_examples) for i in range(args.shards)]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for result in pool.map(verify_shard, tasks):
+                report['vote_counts'].update(result['vote_counts'])
+                report['audit_counts'].update(result['audit_counts'])
+                report['totals'].update(result['totals'])
+                for kind, examples in result['examples'].items():
+                    merged = report['examples'].setdefault(kind, [])
+                    merged.extend(examples[:args.max_examples - len(merged)])
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    if total_votes == 0 and total_audit == 0:
+        report['totals']['no_rows_scanned'] += 1
+        report['examples']['no_rows_scanned'] = [
+            'Neither table returned any rows; check the key, --election-id or dump paths'
+        ]
+
+    for key in report['vote_counts'].keys() | report['audit_counts'].keys():
+        vote_count = report['vote_counts'][key]
+        audit_count = report['audit_counts'][key]
+        if vote_count != audit_count:
+            report['totals']['recount_mismatch'] += 1
+            examples = report['examples'].setdefault('recount_mismatch', [])
+            if len(examples) < args.max_examples:
+                examples.append({
+                    'election_id': key[0],
+                    'candidate_id': key[1],
+                    'votes': vote_count,
+                    'audit_logs': audit_count,
+                })
+
+    if args.api_url:
+        elections = {election_id for election_id, _ in report['vote_counts']}
+        if args.election_id:
+            elections.add(args.election_id)
+        for election_id in sorted(elections):
+            try:
+                api_counts = fetch_api_results(args.api_url, election_id, args.api_timeout)
+            except (OSError, HTTPException, ValueError, KeyError, TypeError) as e:
+                report['totals']['api_results_error'] += 1
+                examples = report['examples'].setdefault('api_results_error', [])
+                if len(examples) < args.max_examples:
+                    examples.append({'election_id': election_id, 'error': str(e)})
+                continue
+            candidates = {c for e, c in report['vote_counts'] if e == election_id} | api_counts.keys()
+            for candidate_id in candidates:
+                recount = report['vote_counts'][(election_id, candidate_id)]
+                reported = api_counts.get(candidate_id, 0)
+                if recount != reported:
+                    report['totals']['api_results_mismatch'] += 1
+                    examples = report['examples'].setdefault('api_results_mismatch', [])
+                    if len(examples) < args.max_examples:
+                        examples.append({
+                            'election_id': election_id,
+                            'candidate_id': candidate_id,
+                            'recount': recount,
+                            'api': reported,
+                        })
+
+    return report
+
+
+def print_report(report):
+    print("\n" + "="*60)
+    print("🔍 Audit Verification Report")
+    print("="*60)
+    print(f"\nVotes scanned:      {report['total_votes']}")
+    print(f"Audit logs scanned: {report['total_audit_logs']}")
+    print(f"Candidates counted: {len(report['vote_counts'].keys() | report['audit_counts'].keys())}")
+
+    if not report['totals']:
+        print("\n✅ No discrepancies found")
+    else:
+        print("\n❌ Discrepancies found:")
+        for kind, count in sorted(report['totals'].items()):
+            print(f"\n  {kind}: {count}")
+            for example in report['examples'].get(kind, []):
+                print(f"    - {example}")
+    print("="*60 + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile votes against audit_logs')
+    parser.add_argument('--votes', help='Path to a CSV/JSONL dump of the votes table')
+    parser.add_argument('--audit-logs', help='Path to a CSV/JSONL dump of the audit_logs table')
+    parser.add_argument('--election-id', help='Only verify a single election')
+    parser.add_argument('--api-url', help='Backend base URL to cross-check /results against')
+    parser.add_argument('--api-timeout', type=float, default=30,
+                        help='Seconds to wait for each /results request (default: 30)')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='Rows requested per page; the server may return fewer if its '
+                             'max_rows is lower, and paging continues regardless (default: 1000)')
+    parser.add_argument('--shards', type=int, default=64,
+                        help=f'Number of on-disk shards, at most {MAX_SHARDS}; peak memory is roughly '
+                             'workers × (rows / shards) (default: 64)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--max-examples', type=int, default=10,
+                        help='Examples listed per discrepancy type (default: 10)')
+    parser.add_argument('--work-dir', help='Directory for temporary shard files')
+    args = parser.parse_args(argv)
+
+    if bool(args.votes) != bool(args.audit_logs):
+        parser.error('--votes and --audit-logs must be given together')
+    if args.chunk_size < 1 or args.shards < 1:
+        parser.error('--chunk-size and --shards must be positive')
+    if args.shards > MAX_SHARDS:
+        parser.error(f'--shards must be at most {MAX_SHARDS}; lower --workers to save more memory')
+    if args.api_timeout <= 0:
+        parser.error('--api-timeout must be positive')
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be positive')
+    if args.max_examples < 0:
+        parser.error('--max-examples must not be negative')
+
+    report = run(args)
+    print_report(report)
+    return 1 if report['totals'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())